@@ -1,7 +1,7 @@
 # Data Cleaning Service with Gemini Integration
-# Version: 3.2 - Increase default concurrency from 5 to 10
-# Changes: Unified max_concurrency for labeling and VisionStruct (default: 10)
-# Previous: v3.1 - Add cost tracking for AI operations
+# Version: 3.3 - Write cleaned results with orjson when available
+# Changes: save_cleaned_result serializes via orjson (falls back to stdlib json)
+# Previous: v3.2 - Increase default concurrency from 5 to 10
 
 import os
 import json
@@ -11,6 +11,12 @@ from dataclasses import dataclass, asdict
 from datetime import datetime
 from pathlib import Path
 
+# orjson is optional - much faster serialization for large cleaned results
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 from gemini_labeler import GeminiLabeler, LabelingMode, LabelingResult, BatchResult, RateLimitError, VisionStructResult
 
 # Configure logging
@@ -611,8 +617,12 @@ class DataCleaningService:
 
         output_path = CLEANED_OUTPUT_DIR / output_filename
 
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(result, f, ensure_ascii=False, indent=2)
+        if orjson is not None:
+            with open(output_path, 'wb') as f:
+                f.write(orjson.dumps(result, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+        else:
+            with open(output_path, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
 
         logger.info(f"Saved cleaned result to: {output_path}")
         return str(output_path)
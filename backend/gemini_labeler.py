@@ -1,9 +1,8 @@
 # OpenRouter Gemini Flash Image and Content Labeling Module
-# Version: 5.9 - Increase default concurrency from 5 to 10 for faster processing
+# Version: 5.77 - Document grouped result demux
 # Changes:
-#   - Increase max_concurrency default from 5 to 10 for both labeling and VisionStruct
-#   - VisionStruct uses Gemini 2.5 Flash (balance), labeling uses 2.0 Flash (cheapest)
-# Previous: v5.8 - Switch VisionStruct to Gemini 2.5 Flash for cost savings
+#   - _label_post_group docstring describes index-based matching with note_id cross-check
+# Previous: v5.76 - Defensive prefilter calls
 #
 # Features:
 # - Concurrent batch processing with configurable parallelism (default: 10)
@@ -19,27 +18,203 @@
 # - Uses OpenRouter API for access to Gemini 2.0 Flash
 
 import os
+import re
 import json
 import logging
 import base64
+import hashlib
+import sqlite3
 import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List, Dict, Any, Optional, Literal, Callable
-from dataclasses import dataclass, asdict
+import random
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
+from typing import List, Dict, Any, Optional, Callable, Tuple
+from dataclasses import dataclass
 from enum import Enum
+from collections import Counter, OrderedDict, deque
 from dotenv import load_dotenv
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from io import BytesIO
+from pathlib import Path
 from PIL import Image
 
-# Load environment variables
-load_dotenv()
+# orjson is optional - parses 3-5x faster than stdlib json on large batches
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# pybase64 is optional - SIMD base64, several times faster on image payloads
+try:
+    import pybase64
+except ImportError:
+    pybase64 = None
+
+# Load environment variables (the API key is the only one this module reads;
+# api.py has usually loaded .env already)
+if not os.getenv("OPEN_ROUTER_API_KEY"):
+    load_dotenv()
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Retry hint inside provider error messages, e.g. "Please retry in 27.5s" or
+# "retryDelay": "27s" - anchored on "retry" so unrelated durations don't match
+_RETRY_AFTER_RE = re.compile(r'retry[^0-9]{0,20}?(\d+(?:\.\d+)?)\s*s', re.IGNORECASE)
+# Substrings (lowercase) that mark an exception message as a rate limit / quota error
+_RATE_LIMIT_TOKENS = ("429", "rate limit", "quota")
+
+# Body of a ``` or ```json fenced block anywhere in a model response
+_MAX_JSON_SPAN_ATTEMPTS = 16  # Balanced spans tried when a response wraps JSON in prose
+_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)\s*```", re.DOTALL | re.IGNORECASE)
+
+# Reject decompression bombs - XHS images are at most a few thousand px per edge.
+# Checked in _decode_and_resize; PIL's process-wide limit is left untouched
+_MAX_IMAGE_PIXELS = 40_000_000
+
+# Source formats sent to the API as-is at full resolution. MPO (multi-picture
+# JPEG from phone cameras) starts with a plain JPEG frame, so it goes as image/jpeg
+_PASSTHROUGH_MIME = {"JPEG": "image/jpeg", "MPO": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+# Suggested location for the opt-in disk cache of downscaled JPEGs
+# (project root, alongside cleaned_output/; gitignored)
+IMAGE_CACHE_DIR = Path(__file__).parent.parent / "image_cache"
+
+
+def _json_loads(text: str) -> Any:
+    """Parse JSON with orjson when installed, otherwise stdlib json"""
+    if orjson is not None:
+        return orjson.loads(text)
+    try:
+        return json.loads(text)
+    except RecursionError:
+        # Pathologically nested input - report it like any other malformed JSON
+        raise json.JSONDecodeError("JSON nested too deeply", text if isinstance(text, str) else "", 0)
+
+
+def _json_body(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """requests kwargs for a JSON body - orjson bytes when installed (Content-Type set on the session)"""
+    if orjson is not None:
+        return {"data": orjson.dumps(payload)}
+    return {"json": payload}
+
+
+def _jpeg_data_uri(jpeg_bytes: bytes, mime_type: str = "image/jpeg") -> str:
+    """Encode image bytes as a data URI (pybase64 when installed, otherwise stdlib)"""
+    if pybase64 is not None:
+        encoded = pybase64.b64encode_as_string(jpeg_bytes)
+    else:
+        encoded = base64.b64encode(jpeg_bytes).decode('ascii')
+    return f"data:{mime_type};base64,{encoded}"
+
+
+def _json_dumps_line(obj: Any) -> bytes:
+    """Serialize one JSONL record (UTF-8, trailing newline)"""
+    if orjson is not None:
+        return orjson.dumps(obj) + b"\n"
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _extract_json_span(text: str, start: int = 0) -> Optional[Tuple[int, str]]:
+    """
+    Find the first balanced {...} or [...] span at or after start.
+    Brace-counting scanner (string/escape aware) - a greedy regex would
+    mis-span when the model adds text containing braces after the JSON.
+    Single pass: a mismatched closer fails every opener still open, so the
+    next candidate is the leftmost nested span that already closed, or the
+    scan simply continues after the mismatch.
+
+    Returns:
+        (span start index, span text) or None if no balanced span exists
+    """
+    stack: List[Tuple[str, int]] = []  # (expected closer, opener index)
+    inner: Optional[Tuple[int, int]] = None  # Leftmost closed span nested in the open candidate
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if not stack:
+            # Between candidates: prose, quotes don't start strings
+            if ch in "{[":
+                stack.append(("}" if ch == "{" else "]", i))
+                inner = None
+                in_string = False
+        elif in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append(("}" if ch == "{" else "]", i))
+        elif ch in "}]":
+            closer, opened = stack.pop()
+            if closer != ch:
+                if inner is not None:
+                    return inner[0], text[inner[0]:inner[1] + 1]
+                stack.clear()  # Mismatched - resume looking for an opener
+            elif not stack:
+                return opened, text[opened:i + 1]
+            elif inner is None or opened < inner[0]:
+                inner = (opened, i)
+    return None
+
+
+def _to_rgb(image: "Image.Image") -> "Image.Image":
+    """
+    Convert to RGB for JPEG encoding. XHS images may be palette/CMYK/RGBA;
+    transparent areas are composited onto white (a plain convert turns them black).
+    """
+    if image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    if image.mode != "RGB":
+        return image.convert("RGB")
+    return image
+
+
+def _decode_and_resize(blob: bytes, max_edge: int, quality: int, passthrough_bytes: int = 0) -> bytes:
+    """
+    Decode image bytes, shrink to fit within max_edge (keeping aspect ratio)
+    and encode as JPEG. Pure bytes-in/bytes-out so it can run in any worker;
+    Pillow releases the GIL while decoding and resampling, so the download
+    thread pool already spreads this across cores.
+
+    Args:
+        blob: Encoded image bytes (JPEG/PNG/WebP...)
+        max_edge: Maximum width/height in pixels
+        quality: JPEG quality (1-95)
+        passthrough_bytes: RGB JPEGs within max_edge and at most this size are
+            returned unchanged (re-encoding would not make them smaller)
+
+    Returns:
+        JPEG encoded bytes
+    """
+    image = Image.open(BytesIO(blob))
+    # Only the header has been read so far - cheap checks before any decoding
+    width, height = image.size
+    if width * height > _MAX_IMAGE_PIXELS:
+        raise ValueError(f"image too large ({width}x{height} px)")
+    if (len(blob) <= passthrough_bytes and image.format == "JPEG" and image.mode == "RGB"
+            and max(image.size) <= max_edge):
+        return blob
+    # For JPEG sources, let libjpeg decode at 1/2, 1/4 or 1/8 scale directly -
+    # far cheaper than a full-size decode followed by LANCZOS
+    image.draft("RGB", (max_edge, max_edge))
+    image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+    image = _to_rgb(image)
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
 
 class RateLimitError(Exception):
     """Custom exception for API rate limit (429) errors"""
@@ -72,6 +247,53 @@ STYLE_CATEGORIES = [
     "信息图",  # Infographic (text overlays, lists, menus)
 ]
 
+# O(1) validation sets for parsed responses
+_LABEL_SET = frozenset(("满足", "不满足"))
+_STYLE_SET = frozenset(STYLE_CATEGORIES)
+
+# JSON schema for one post's label - sent as response_format so the model is
+# constrained to valid JSON with enum-checked label/style_label values
+LABEL_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "label": {"type": "string", "enum": ["满足", "不满足"]},
+        "style_label": {"type": "string", "enum": STYLE_CATEGORIES},
+        "reasoning": {"type": "string"}
+    },
+    "required": ["label", "style_label", "reasoning"],
+    "additionalProperties": False
+}
+
+# Grouped labeling wraps one labeled item per post (keyed by note_id)
+GROUP_LABEL_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "results": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "index": {"type": "integer"},
+                    "note_id": {"type": "string"},
+                    **LABEL_JSON_SCHEMA["properties"]
+                },
+                "required": ["index", "note_id", *LABEL_JSON_SCHEMA["required"]],
+                "additionalProperties": False
+            }
+        }
+    },
+    "required": ["results"],
+    "additionalProperties": False
+}
+
+# Style category definitions shared by single-post and grouped prompts
+# (must stay in sync with buildFullPrompt in frontend WashingMachine.tsx)
+STYLE_CATEGORY_GUIDE = """- 人物图: Person-focused shots where people are the visual focus - facing camera, check-in poses, or people as the main subject even in distant/scenic backgrounds
+- 特写图: Close-up shots of objects/food where the subject fills most of the frame (80%+), surroundings are minimal (not about people)
+- 环境图: Scene/ambiance shots showing location, atmosphere; people may appear but are NOT the visual focus (small in frame, not facing camera)
+- 拼接图: Collage or composite images combining multiple photos into one
+- 信息图: Infographic style with text overlays, promotional content, menus, price lists"""
+
 # VisionStruct prompt for detailed image analysis (vision-to-JSON)
 # Extended with food_analysis section for ingredient/presentation analysis
 VISION_STRUCT_PROMPT = """You are VisionStruct, an advanced Computer Vision & Data Serialization Engine. Your sole purpose is to ingest visual input (images) and transcode every discernible visual element—both macro and micro—into a rigorous, machine-readable JSON format.
@@ -367,7 +589,15 @@ class LabelingResult:
     cost: float = 0.0  # API cost in USD from OpenRouter
 
     def to_dict(self) -> dict:
-        return asdict(self)
+        # Flat fields only - avoids asdict()'s recursive deepcopy per result
+        return {
+            "note_id": self.note_id,
+            "label": self.label,
+            "style_label": self.style_label,
+            "reasoning": self.reasoning,
+            "error": self.error,
+            "cost": self.cost
+        }
 
 
 @dataclass
@@ -379,7 +609,13 @@ class VisionStructResult:
     cost: float = 0.0  # API cost in USD from OpenRouter
 
     def to_dict(self) -> dict:
-        return asdict(self)
+        # asdict() would deep-copy the whole (large) vision_struct tree per result
+        return {
+            "note_id": self.note_id,
+            "vision_struct": self.vision_struct,
+            "error": self.error,
+            "cost": self.cost
+        }
 
 
 @dataclass
@@ -409,6 +645,96 @@ class BatchResult:
         }
 
 
+class SlidingWindowLimiter:
+    """
+    Thread-safe sliding-window limiter: at most rpm acquisitions per window.
+    Shared by all batch workers so requests are spaced out before the
+    provider has to reject them (rejected 429s still count toward quota).
+    """
+
+    def __init__(self, rpm: int, window: float = 60.0):
+        self.rpm = rpm
+        self.window = window
+        self._timestamps: deque = deque()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent, then record it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._timestamps and self._timestamps[0] <= now - self.window:
+                    self._timestamps.popleft()
+                if self._blocked_until > now:
+                    wait = self._blocked_until - now
+                elif len(self._timestamps) < self.rpm:
+                    self._timestamps.append(now)
+                    return
+                else:
+                    wait = self._timestamps[0] + self.window - now
+            time.sleep(wait)
+
+    def block_for(self, seconds: float):
+        """Hold off every caller for seconds (e.g. a 429 Retry-After)."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+
+class AIMDConcurrency:
+    """
+    Additive-increase / multiplicative-decrease gate on in-flight API calls.
+    Grows the limit by `increase` on every success and halves it on overload
+    (429, repeated 5xx, or the latency EWMA exceeding latency_target),
+    discovering how much parallelism the quota allows instead of using a
+    fixed worker count.
+    """
+
+    def __init__(self, initial: float, minimum: float = 1.0, maximum: float = 32.0,
+                 increase: float = 0.5, decrease: float = 0.5,
+                 latency_target: Optional[float] = None):
+        self.limit = min(max(initial, minimum), maximum)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_target = latency_target
+        self.latency_ewma: Optional[float] = None
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self._in_flight >= int(self.limit):
+                self._cond.wait()
+            self._in_flight += 1
+
+    def release(self, latency: Optional[float], overloaded: bool = False):
+        """
+        Return a slot and adjust the limit from the call's outcome.
+        latency is the API round trip in seconds, or None when no request was
+        sent (e.g. a cache hit) - that carries no signal and leaves the limit as is.
+        """
+        with self._cond:
+            self._in_flight -= 1
+            if latency is not None:
+                ewma = self.latency_ewma
+                self.latency_ewma = latency if ewma is None else 0.8 * ewma + 0.2 * latency
+                if self.latency_target and self.latency_ewma > self.latency_target:
+                    overloaded = True
+            now = time.monotonic()
+            if overloaded:
+                # Calls already in flight when we backed off report the same
+                # congestion - decrease at most once per round trip
+                if now - self._last_decrease >= (self.latency_ewma or 0.0):
+                    self.limit = max(self.minimum, self.limit * self.decrease)
+                    self._last_decrease = now
+            elif latency is not None:
+                self.limit = min(self.maximum, self.limit + self.increase)
+            self._cond.notify_all()
+
+
 class GeminiLabeler:
     """
     Gemini 2.0 Flash client via OpenRouter for image and content labeling.
@@ -427,19 +753,149 @@ class GeminiLabeler:
     DEFAULT_MODEL = "google/gemini-2.0-flash-001"  # For labeling (cheaper)
     VISION_STRUCT_MODEL = "google/gemini-2.5-flash"  # For VisionStruct (balance of cost/quality)
 
-    def __init__(self, api_key: Optional[str] = None, model_name: str = None):
+    # Generation parameters shared by every request (built once at import)
+    LABEL_GENERATION_PARAMS = {
+        "temperature": 0.1,
+        "top_p": 0.95,
+        "max_tokens": 256,  # label + style_label + brief Chinese reasoning
+        "response_format": {
+            "type": "json_schema",
+            "json_schema": {"name": "post_label", "strict": True, "schema": LABEL_JSON_SCHEMA}
+        }
+    }
+    VISION_STRUCT_GENERATION_PARAMS = {
+        "temperature": 0.1,
+        "top_p": 0.95,
+        "max_tokens": 4096  # Larger for detailed VisionStruct output
+    }
+
+    # Per-mode inputs: (needs_cover, needs_all_images, needs_title, needs_content).
+    # O(1) lookup instead of scanning mode lists on every post.
+    _MODE_FLAGS: Dict[LabelingMode, Tuple[bool, bool, bool, bool]] = {
+        LabelingMode.COVER_IMAGE: (True, False, False, False),
+        LabelingMode.ALL_IMAGES: (False, True, False, False),
+        LabelingMode.TITLE: (False, False, True, False),
+        LabelingMode.CONTENT: (False, False, False, True),
+        LabelingMode.TITLE_CONTENT: (False, False, True, True),
+        LabelingMode.COVER_IMAGE_TITLE: (True, False, True, False),
+        LabelingMode.COVER_IMAGE_CONTENT: (True, False, False, True),
+        LabelingMode.ALL_IMAGES_TITLE: (False, True, True, False),
+        LabelingMode.ALL_IMAGES_CONTENT: (False, True, False, True),
+        LabelingMode.FULL: (False, True, True, True),  # all images already include the cover
+    }
+    assert set(_MODE_FLAGS) == set(LabelingMode), "_MODE_FLAGS must cover every LabelingMode"
+
+    # Modes where several posts can share one API request: text-only modes and
+    # single cover-image modes (all-images modes are too large per post)
+    GROUPABLE_MODES = (
+        LabelingMode.TITLE, LabelingMode.CONTENT, LabelingMode.TITLE_CONTENT,
+        LabelingMode.COVER_IMAGE, LabelingMode.COVER_IMAGE_TITLE, LabelingMode.COVER_IMAGE_CONTENT
+    )
+    MAX_GROUP_IMAGES = 20  # Cover images per grouped request (context/payload limit)
+    PREFETCH_WORKERS = 4  # Threads warming the image cache ahead of batch workers
+
+    # Retry policy for transient API failures (connection errors, timeouts, 5xx)
+    API_MAX_ATTEMPTS = 5
+    API_BACKOFF_BASE = 1.0   # seconds; doubles per attempt
+    API_BACKOFF_MAX = 30.0   # cap on a single backoff sleep
+    RATE_LIMIT_MAX_WAIT = 90  # Longer retry_after (quota exhausted) stops the batch
+    ADAPTIVE_MAX_CONCURRENCY = 32  # Pool size / AIMD ceiling for adaptive_concurrency
+    AIMD_SERVER_ERROR_THRESHOLD = 2  # 5xx/timeouts within one unit that count as overload
+    RATE_LIMIT_JITTER = 2.0  # Max random extra seconds per worker when a 429 pause ends
+
+    DISK_CACHE_PRUNE_INTERVAL = 1000  # Disk cache writes between background prunes
+
+    # Browser-like headers to bypass CDN restrictions (image_session defaults)
+    IMAGE_REQUEST_HEADERS = {
+        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+        "Accept": "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8",
+        "Accept-Language": "en-US,en;q=0.9,zh-CN;q=0.8,zh;q=0.7",
+        "Referer": "https://www.xiaohongshu.com/"
+    }
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        model_name: str = None,
+        max_image_edge: int = 1024,
+        jpeg_quality: int = 85,
+        image_cache_size: int = 256,
+        image_cache_dir: Optional[str] = None,
+        image_cache_max_files: int = 20000,
+        label_cache_size: int = 4096,
+        label_cache_path: Optional[str] = None,
+        label_cache_ttl: Optional[float] = None,
+        max_image_bytes: int = 8_000_000,
+        passthrough_bytes: int = 150_000,
+        requests_per_minute: Optional[int] = None
+    ):
         """
         Initialize Gemini labeler with OpenRouter API key.
 
         Args:
             api_key: OpenRouter API key (defaults to OPEN_ROUTER_API_KEY env var)
             model_name: Model to use (default: google/gemini-2.0-flash-001)
+            max_image_edge: Long-edge pixel cap for images sent to the model
+            jpeg_quality: JPEG quality used when re-encoding downscaled images
+            image_cache_size: Max encoded images kept in memory by URL (0 disables)
+            image_cache_dir: Directory for the on-disk JPEG cache, e.g. IMAGE_CACHE_DIR
+                (None = memory cache only)
+            image_cache_max_files: Disk cache entries kept (least recently used pruned)
+            label_cache_size: Max parsed label results kept in memory (0 disables)
+            label_cache_path: SQLite file that persists cached label results across
+                restarts (None = memory only)
+            label_cache_ttl: Seconds a cached label stays valid (None = no expiry)
+            max_image_bytes: Downloads larger than this are aborted
+            passthrough_bytes: Small JPEGs already within max_image_edge are sent
+                without re-encoding (0 always re-encodes)
+            requests_per_minute: Client-side cap on API requests per minute across
+                all threads (None = unlimited, rely on 429 handling)
         """
         self.api_key = api_key or os.getenv("OPEN_ROUTER_API_KEY")
         if not self.api_key:
             raise ValueError("OPEN_ROUTER_API_KEY not found in environment or constructor")
 
         self.model_name = model_name or self.DEFAULT_MODEL
+        self.max_image_edge = max_image_edge
+        self.jpeg_quality = jpeg_quality
+        self.image_cache_size = image_cache_size
+        self.max_image_bytes = max_image_bytes
+        self.passthrough_bytes = passthrough_bytes
+        self._limiter = SlidingWindowLimiter(requests_per_minute) if requests_per_minute else None
+
+        # LRU cache of encoded data URIs keyed by image URL (shared across batches)
+        self._image_cache: "OrderedDict[str, str]" = OrderedDict()
+        self._image_cache_lock = threading.Lock()
+        # URL -> Future of the fetch currently running for it (guarded by _image_cache_lock)
+        self._image_inflight: Dict[str, "Future[Optional[str]]"] = {}
+
+        # LRU cache of successful LabelingResult dicts keyed by request signature
+        self.label_cache_size = label_cache_size
+        self.label_cache_ttl = label_cache_ttl
+        # key -> (created_at, result dict)
+        self._label_cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._label_cache_lock = threading.Lock()
+        self._label_db: Optional[sqlite3.Connection] = None
+        if label_cache_path and label_cache_size > 0:
+            # Shared by worker threads; every access is serialized by _label_cache_lock
+            self._label_db = sqlite3.connect(label_cache_path, check_same_thread=False)
+            self._label_db.execute(
+                "CREATE TABLE IF NOT EXISTS label_cache (key TEXT PRIMARY KEY, result TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            if label_cache_ttl:
+                self._label_db.execute(
+                    "DELETE FROM label_cache WHERE created_at < ?", (time.time() - label_cache_ttl,)
+                )
+            self._label_db.commit()
+
+        # On-disk cache of downscaled JPEGs, survives restarts
+        self.image_cache_dir = Path(image_cache_dir) if image_cache_dir else None
+        self.image_cache_max_files = image_cache_max_files
+        if self.image_cache_dir:
+            self.image_cache_dir.mkdir(parents=True, exist_ok=True)
+        # Pruning is deferred to the first write so constructing a labeler stays cheap
+        self._disk_cache_writes = 0
+        self._disk_prune_running = False
 
         # Set up request headers
         self.headers = {
@@ -449,19 +905,61 @@ class GeminiLabeler:
             "X-Title": "SmartICE XHS Labeler"
         }
 
-        # Create session - keep system proxy (Cloudflare blocks direct connections)
-        # Retry logic handles intermittent proxy failures
+        # Create sessions - keep system proxy (Cloudflare blocks direct connections)
+        # trust_env=True (default) to use HTTP_PROXY/HTTPS_PROXY env vars.
+        # API session: single OpenRouter host, POST retries handled in _post_chat_completion
         self.session = requests.Session()
-        # trust_env=True (default) to use HTTP_PROXY/HTTPS_PROXY env vars
         self.session.headers.update(self.headers)
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=64))
+
+        # Image session: browser-like headers as defaults (never the API key).
+        # Pooled keep-alive connections shared by all worker threads - avoids a
+        # TCP+TLS handshake per image; adapter retries cover idempotent GETs only.
+        self.image_session = requests.Session()
+        self.image_session.headers.update(self.IMAGE_REQUEST_HEADERS)
+        image_adapter = HTTPAdapter(
+            pool_connections=32,
+            pool_maxsize=64,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.3,
+                status_forcelist=(500, 502, 503, 504),
+                allowed_methods=frozenset({"GET"})
+            )
+        )
+        self.image_session.mount("https://", image_adapter)
+        self.image_session.mount("http://", image_adapter)
+
+        # Shared pool for fetching a post's images in parallel (ALL_IMAGES/FULL modes)
+        self._download_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="xhs-image")
 
         # Real-time tracking for cancellation support
         self._current_results: List[Optional[LabelingResult]] = []
         self._current_posts: List[Dict[str, Any]] = []
         self._results_lock = threading.Lock()
 
+        # Per-thread API call stats ({"api_seconds", "api_calls", "server_errors"})
+        # collected by _post_chat_completion while a batch worker sets .current
+        self._call_stats = threading.local()
+
         logger.info(f"Initialized GeminiLabeler via OpenRouter with model: {self.model_name}")
 
+    def close(self):
+        """Close the HTTP sessions, image download pool and label cache database"""
+        self._download_pool.shutdown(wait=False)
+        self.session.close()
+        self.image_session.close()
+        if self._label_db is not None:
+            with self._label_cache_lock:
+                self._label_db.close()
+                self._label_db = None
+
+    def __enter__(self) -> "GeminiLabeler":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
     def _build_prompt(self, user_description: str) -> str:
         """
         Build the full prompt for binary classification with style labeling.
@@ -479,11 +977,7 @@ User's filter criteria: {user_description}
 Based on this criteria, determine if the post matches (满足) or doesn't match (不满足).
 
 Also classify the image style into ONE of these 5 mutually exclusive categories (判断依据是视觉焦点):
-- 人物图: Person-focused shots where people are the visual focus - facing camera, check-in poses, or people as the main subject even in distant/scenic backgrounds
-- 特写图: Close-up shots of objects/food where the subject fills most of the frame (80%+), surroundings are minimal (not about people)
-- 环境图: Scene/ambiance shots showing location, atmosphere; people may appear but are NOT the visual focus (small in frame, not facing camera)
-- 拼接图: Collage or composite images combining multiple photos into one
-- 信息图: Infographic style with text overlays, promotional content, menus, price lists
+{STYLE_CATEGORY_GUIDE}
 
 Output your analysis in this exact JSON format:
 {{
@@ -494,7 +988,10 @@ Output your analysis in this exact JSON format:
 
     def _download_image_as_base64(self, url: str) -> Optional[str]:
         """
-        Download image from URL and return as base64 encoded string.
+        Return the base64 data URI for an image URL, reusing previously encoded
+        images. The labeler is long-lived (one per DataCleaningService), so
+        re-labeling the same posts with new criteria skips download + re-encode.
+        Concurrent calls for the same URL wait on one shared fetch.
 
         Args:
             url: Image URL to download
@@ -502,36 +999,186 @@ Output your analysis in this exact JSON format:
         Returns:
             Base64 encoded image string or None if download fails
         """
+        with self._image_cache_lock:
+            cached = self._image_cache.get(url)
+            if cached is not None:
+                self._image_cache.move_to_end(url)
+                return cached
+            # Another thread is already fetching this URL - wait for its result
+            inflight = self._image_inflight.get(url)
+            if inflight is None:
+                inflight = Future()
+                self._image_inflight[url] = inflight
+                is_leader = True
+            else:
+                is_leader = False
+
+        if not is_leader:
+            return inflight.result()
+
+        data_uri = None
+        try:
+            data_uri = self._fetch_image_as_base64(url)
+        finally:
+            with self._image_cache_lock:
+                if data_uri is not None and self.image_cache_size > 0:
+                    self._image_cache[url] = data_uri
+                    self._image_cache.move_to_end(url)
+                    while len(self._image_cache) > self.image_cache_size:
+                        self._image_cache.popitem(last=False)  # Evict least recently used
+                del self._image_inflight[url]
+            inflight.set_result(data_uri)
+        return data_uri
+
+    def _disk_cache_path(self, url: str) -> Optional[Path]:
+        """
+        Cache file for an image URL. The key includes the resize settings so
+        labelers with different max_image_edge/jpeg_quality don't collide.
+        """
+        if self.image_cache_dir is None:
+            return None
+        key = hashlib.sha256(f"{url}|{self.max_image_edge}|{self.jpeg_quality}".encode("utf-8")).hexdigest()
+        return self.image_cache_dir / f"{key}.jpg"
+
+    def _prune_disk_cache(self):
+        """Delete least recently used cache files beyond image_cache_max_files."""
         try:
-            # Use browser-like headers to bypass CDN restrictions
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-                "Accept": "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8",
-                "Accept-Language": "en-US,en;q=0.9,zh-CN;q=0.8,zh;q=0.7",
-                "Referer": "https://www.xiaohongshu.com/"
-            }
-            response = self.session.get(url, headers=headers, timeout=10)
-            response.raise_for_status()
+            entries = [(entry.stat().st_mtime, entry) for entry in self.image_cache_dir.glob("*.jpg")]
+        except OSError as e:
+            logger.warning(f"Failed to scan image cache {self.image_cache_dir}: {e}")
+            return
+
+        excess = len(entries) - self.image_cache_max_files
+        if excess <= 0:
+            return
+        entries.sort(key=lambda item: item[0])
+        for _, entry in entries[:excess]:
+            entry.unlink(missing_ok=True)
+        logger.info(f"Pruned {excess} old entries from image cache {self.image_cache_dir}")
+
+    def _write_disk_cache(self, cache_path: Path, jpeg_bytes: bytes):
+        """Atomically write a cache entry (tmp file + rename) so a crash never leaves a partial JPEG."""
+        tmp_path = cache_path.with_name(f"{cache_path.name}.{threading.get_ident()}.tmp")
+        try:
+            tmp_path.write_bytes(jpeg_bytes)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.warning(f"Failed to write image cache {cache_path}: {e}")
+            tmp_path.unlink(missing_ok=True)
+            return
+
+        with self._image_cache_lock:
+            start_prune = (self._disk_cache_writes % self.DISK_CACHE_PRUNE_INTERVAL == 0
+                           and not self._disk_prune_running)
+            self._disk_cache_writes += 1
+            if start_prune:
+                self._disk_prune_running = True
+        if start_prune:
+            threading.Thread(target=self._run_disk_prune, name="image-cache-prune", daemon=True).start()
+
+    def _run_disk_prune(self):
+        """Background prune; readers tolerate entries vanishing (they re-download)."""
+        try:
+            self._prune_disk_cache()
+        finally:
+            with self._image_cache_lock:
+                self._disk_prune_running = False
 
-            # Detect image type from content-type header or URL
-            content_type = response.headers.get('content-type', 'image/jpeg')
-            if 'png' in content_type or url.lower().endswith('.png'):
-                mime_type = 'image/png'
-            elif 'gif' in content_type or url.lower().endswith('.gif'):
-                mime_type = 'image/gif'
-            elif 'webp' in content_type or url.lower().endswith('.webp'):
-                mime_type = 'image/webp'
-            else:
-                mime_type = 'image/jpeg'
+    def _fetch_image_as_base64(self, url: str) -> Optional[str]:
+        """
+        Download image from URL and return as base64 encoded string.
+        Image is downscaled to max_image_edge and re-encoded as JPEG to keep
+        the upload payload small (Gemini does not need full CDN resolution).
+        The JPEG is read from / written to the disk cache when enabled.
+
+        Args:
+            url: Image URL to download
+
+        Returns:
+            Base64 encoded image string or None if download fails
+        """
+        cache_path = self._disk_cache_path(url)
+        if cache_path is not None and cache_path.exists():
+            try:
+                jpeg_bytes = cache_path.read_bytes()
+                os.utime(cache_path)  # Mark as recently used for pruning
+                return _jpeg_data_uri(jpeg_bytes)
+            except OSError as e:
+                logger.warning(f"Failed to read cached image {cache_path}: {e}")
+
+        try:
+            # Downscale and re-encode as JPEG before base64
+            jpeg_bytes = _decode_and_resize(
+                self._read_image_bytes(url), self.max_image_edge, self.jpeg_quality, self.passthrough_bytes
+            )
+            if cache_path is not None:
+                self._write_disk_cache(cache_path, jpeg_bytes)
 
             # Encode to base64
-            base64_image = base64.b64encode(response.content).decode('utf-8')
-            return f"data:{mime_type};base64,{base64_image}"
+            return _jpeg_data_uri(jpeg_bytes)
+
+        except Exception as e:
+            logger.error(f"Failed to download image from {url}: {e}")
+            return None
 
+    def _fetch_original_image_as_base64(self, url: str) -> Optional[str]:
+        """
+        Download an image and return it as a data URI at original resolution
+        (no downscale, no caching). JPEG/PNG/WebP are sent unchanged; other
+        formats are re-encoded to JPEG at full size. Used by VisionStruct,
+        which extracts fine detail the labeling downscale loses.
+
+        Args:
+            url: Image URL to download
+
+        Returns:
+            Base64 data URI or None if download fails
+        """
+        try:
+            blob = self._read_image_bytes(url)
+            image = Image.open(BytesIO(blob))  # Header only
+            mime_type = _PASSTHROUGH_MIME.get(image.format)
+            if mime_type is not None:
+                return _jpeg_data_uri(blob, mime_type)
+            # GIF/BMP/TIFF/...: re-encode without shrinking (max_edge = current size)
+            jpeg_bytes = _decode_and_resize(blob, max(image.size), self.jpeg_quality)
+            return _jpeg_data_uri(jpeg_bytes)
         except Exception as e:
             logger.error(f"Failed to download image from {url}: {e}")
             return None
 
+    def _read_image_bytes(self, url: str) -> bytes:
+        """
+        Download raw image bytes, rejecting non-image, empty and oversized responses.
+
+        Raises:
+            requests.RequestException or ValueError on failure
+        """
+        # (connect, read) timeouts - fail fast on unreachable CDN hosts.
+        # stream=True reads the body in chunks so oversized images are
+        # aborted early instead of being buffered whole; the connection
+        # goes back to the pool as soon as the with-block exits.
+        with self.image_session.get(url, timeout=(3, 10), stream=True) as response:
+            response.raise_for_status()
+            # CDN error pages come back as 200 text/html; some valid images are
+            # served as application/octet-stream, so only reject known non-images
+            content_type = response.headers.get("Content-Type", "").lower()
+            if content_type.startswith(("text/", "application/json")):
+                raise ValueError(f"not an image (Content-Type: {content_type})")
+            declared = response.headers.get("Content-Length")
+            if declared is not None and int(declared) == 0:
+                raise ValueError("empty image response")
+            if declared is not None and int(declared) > self.max_image_bytes:
+                raise ValueError(f"image too large ({declared} bytes)")
+            buffer = BytesIO()
+            for chunk in response.iter_content(65536):  # Decodes gzip/deflate
+                buffer.write(chunk)
+                if buffer.tell() > self.max_image_bytes:
+                    raise ValueError(f"image too large (>{self.max_image_bytes} bytes)")
+            if buffer.tell() == 0:
+                raise ValueError("empty image response")
+        return buffer.getvalue()
+
     def _prepare_content_parts(
         self,
         post: Dict[str, Any],
@@ -553,19 +1200,18 @@ Output your analysis in this exact JSON format:
             List of content parts in OpenAI format
         """
         parts = []
+        needs_cover, needs_all_images, needs_title, needs_content = self._MODE_FLAGS[mode]
 
         # Build text content
         text_content = full_prompt
 
         # Add text based on mode
-        if mode in [LabelingMode.TITLE, LabelingMode.TITLE_CONTENT, LabelingMode.COVER_IMAGE_TITLE,
-                    LabelingMode.ALL_IMAGES_TITLE, LabelingMode.FULL]:
+        if needs_title:
             title = post.get("title", "")
             if title:
                 text_content += f"\n\nTitle: {title}"
 
-        if mode in [LabelingMode.CONTENT, LabelingMode.TITLE_CONTENT, LabelingMode.COVER_IMAGE_CONTENT,
-                    LabelingMode.ALL_IMAGES_CONTENT, LabelingMode.FULL]:
+        if needs_content:
             content = post.get("content", "")
             if content:
                 text_content += f"\n\nContent: {content}"
@@ -577,75 +1223,325 @@ Output your analysis in this exact JSON format:
 
         # Add the text part first
         parts.append({"type": "text", "text": text_content})
+        if not (needs_cover or needs_all_images):
+            return parts  # Text-only mode
 
         # Add images based on mode - download and encode as base64
         # (XHS CDN URLs block direct access from external servers)
-        if mode in [LabelingMode.COVER_IMAGE, LabelingMode.COVER_IMAGE_TITLE,
-                    LabelingMode.COVER_IMAGE_CONTENT]:
+        for base64_url in self._download_images_as_base64(self._post_image_urls(post, mode)):
+            if base64_url:
+                parts.append({
+                    "type": "image_url",
+                    "image_url": {"url": base64_url}
+                })
+
+        return parts
+
+    def _post_image_urls(self, post: Dict[str, Any], mode: LabelingMode) -> List[str]:
+        """Image URLs a mode sends for a post, deduplicated in order."""
+        needs_cover, needs_all_images, _, _ = self._MODE_FLAGS[mode]
+        image_urls: List[str] = []
+        if needs_cover:
             cover_url = post.get("cover_image")
             if cover_url:
-                base64_url = self._download_image_as_base64(cover_url)
-                if base64_url:
-                    parts.append({
-                        "type": "image_url",
-                        "image_url": {"url": base64_url}
-                    })
-
-        if mode in [LabelingMode.ALL_IMAGES, LabelingMode.ALL_IMAGES_TITLE,
-                    LabelingMode.ALL_IMAGES_CONTENT, LabelingMode.FULL]:
+                image_urls.append(cover_url)
+
+        if needs_all_images:
             images = post.get("images", [])
             if not images and post.get("cover_image"):
                 images = [post["cover_image"]]
+            image_urls.extend(images)
 
-            for img_url in images:
-                base64_url = self._download_image_as_base64(img_url)
-                if base64_url:
-                    parts.append({
-                        "type": "image_url",
-                        "image_url": {"url": base64_url}
-                    })
+        # XHS image lists can repeat a URL - send each image once, in order
+        return list(dict.fromkeys(image_urls))
 
-        return parts
+    def _download_images_as_base64(self, urls: List[str]) -> List[Optional[str]]:
+        """
+        Download several images concurrently, preserving input order.
+
+        Args:
+            urls: Image URLs to download
 
-    def _parse_json_response(self, response_text: str) -> Dict[str, Any]:
+        Returns:
+            Base64 data URIs (None for failed downloads) in the same order as urls
+        """
+        if len(urls) <= 1:
+            return [self._download_image_as_base64(url) for url in urls]
+        # Overlap network round-trips: a 9-image post costs ~1 RTT instead of 9
+        return list(self._download_pool.map(self._download_image_as_base64, urls))
+
+    def _parse_json_response(self, response_text: str, first_item: bool = True) -> Any:
         """
         Parse JSON response, handling potential formatting issues.
 
         Args:
             response_text: Raw response text from API
+            first_item: Unwrap a top-level JSON array to its first element
 
         Returns:
-            Parsed JSON dictionary
+            Parsed JSON dictionary (or list when first_item=False)
         """
         text = response_text.strip()
 
-        # Remove markdown code blocks if present
-        if text.startswith("```json"):
-            text = text[7:]
-        elif text.startswith("```"):
-            text = text[3:]
-
-        if text.endswith("```"):
-            text = text[:-3]
-
-        text = text.strip()
+        # Schema-constrained responses are bare JSON - only look for a markdown
+        # code block (possibly with text around it) when that's not the case
+        if not text.startswith(("{", "[")):
+            fence = _FENCE_RE.search(text)
+            if fence:
+                text = fence.group(1)
 
         try:
-            result = json.loads(text)
-            if isinstance(result, list) and len(result) > 0:
-                return result[0]
-            return result
+            result = _json_loads(text)
         except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse JSON response: {e}")
-            logger.error(f"Raw response: {response_text}")
-            raise
+            # Model wrapped the JSON in prose - take the first balanced span that parses
+            result = None
+            found = _extract_json_span(text)
+            for _ in range(_MAX_JSON_SPAN_ATTEMPTS):
+                if found is None:
+                    break
+                span_start, span = found
+                try:
+                    result = _json_loads(span)
+                    break
+                except json.JSONDecodeError:
+                    found = _extract_json_span(text, span_start + 1)
+            else:
+                found = None  # Gave up - treat as unparseable
+            if found is None:
+                logger.error(f"Failed to parse JSON response: {e}")
+                logger.error(f"Raw response: {response_text}")
+                raise
+
+        if first_item and isinstance(result, list) and len(result) > 0:
+            return result[0]
+        return result
+
+    def _post_chat_completion(
+        self,
+        payload: Dict[str, Any],
+        timeout: int,
+        context: str
+    ) -> tuple[str, float]:
+        """
+        Send a chat completion request to OpenRouter with connection retry logic.
+
+        Args:
+            payload: OpenAI-compatible request payload
+            timeout: Request timeout in seconds
+            context: Short description for log messages (e.g. note_id)
+
+        Returns:
+            Tuple of (message content, API cost in USD)
+
+        Raises:
+            RateLimitError: On HTTP 429
+        """
+        # Make the API request, retrying transient failures (connection errors,
+        # timeouts, 5xx) with exponential backoff and full jitter. 4xx is final.
+        response = None
+        stats = getattr(self._call_stats, "current", None)
+        for attempt in range(self.API_MAX_ATTEMPTS):
+            if self._limiter is not None:
+                self._limiter.acquire()
+            sent = time.monotonic()
+            try:
+                response = self.session.post(
+                    self.OPENROUTER_BASE_URL,
+                    timeout=timeout,
+                    **_json_body(payload)
+                )
+                if stats is not None:
+                    stats["api_seconds"] += time.monotonic() - sent
+                    stats["api_calls"] += 1
+                    stats["server_errors"] += response.status_code >= 500
+                if response.status_code < 500 or attempt == self.API_MAX_ATTEMPTS - 1:
+                    break  # Success or non-retryable status
+                reason = f"HTTP {response.status_code}"
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if stats is not None and isinstance(e, requests.exceptions.Timeout):
+                    stats["api_seconds"] += time.monotonic() - sent
+                    stats["api_calls"] += 1
+                    stats["server_errors"] += 1
+                if attempt == self.API_MAX_ATTEMPTS - 1:
+                    raise  # Re-raise on final attempt
+                reason = str(e)
+
+            wait_time = random.uniform(0, min(self.API_BACKOFF_MAX, self.API_BACKOFF_BASE * 2 ** attempt))
+            logger.warning(f"Transient error for {context}, retry {attempt + 1}/{self.API_MAX_ATTEMPTS} in {wait_time:.1f}s: {reason}")
+            time.sleep(wait_time)
+
+        if response is None:
+            raise ValueError("No response received after retries")
+
+        # Log error details for debugging
+        if response.status_code >= 400:
+            logger.error(f"API error {response.status_code} for {context}: {response.text}")
+
+        # Check for rate limit errors
+        if response.status_code == 429:
+            retry_after = int(response.headers.get('Retry-After', 60))
+            if self._limiter is not None:
+                self._limiter.block_for(retry_after)
+            raise RateLimitError(
+                f"Rate limit exceeded. Please wait {retry_after}s before retrying.",
+                retry_after=retry_after
+            )
+
+        response.raise_for_status()
+
+        # Parse the response
+        response_data = _json_loads(response.content)
+
+        # Extract cost from OpenRouter response (in USD)
+        api_cost = 0.0
+        if 'usage' in response_data:
+            api_cost = response_data['usage'].get('cost', 0.0) or 0.0
+
+        # Extract the message content
+        if 'choices' not in response_data or len(response_data['choices']) == 0:
+            raise ValueError("No response choices returned from API")
+
+        return response_data['choices'][0]['message']['content'], api_cost
+
+    def _raise_if_rate_limited(self, error_str: str):
+        """
+        Convert rate limit / quota errors embedded in exception messages to RateLimitError.
+
+        Args:
+            error_str: Exception message
+
+        Raises:
+            RateLimitError: If the message indicates a 429 / quota error
+        """
+        lowered = error_str.lower()
+        if not any(token in lowered for token in _RATE_LIMIT_TOKENS):
+            return
+
+        retry_after = 60
+        match = _RETRY_AFTER_RE.search(error_str)
+        if match:
+            retry_after = int(float(match.group(1))) + 5
+
+        raise RateLimitError(
+            f"Rate limit exceeded. Please wait {retry_after}s before retrying.",
+            retry_after=retry_after
+        )
+
+    def _to_labeling_result(self, note_id: str, result_json: Dict[str, Any], cost: float) -> LabelingResult:
+        """
+        Validate parsed label JSON and build a LabelingResult.
+        The response schema already constrains these values; the checks here
+        only guard against providers/models that ignore response_format.
+
+        Args:
+            note_id: Post note_id
+            result_json: Parsed JSON object with label, style_label, reasoning
+            cost: API cost attributed to this post
+
+        Returns:
+            LabelingResult with invalid values replaced by defaults
+        """
+        # Extract label (满足/不满足)
+        label = result_json.get("label", "不满足")
+        if label not in _LABEL_SET:
+            logger.warning(f"Invalid label '{label}' for {note_id}, defaulting to '不满足'")
+            label = "不满足"
+
+        # Extract style_label
+        style_label = result_json.get("style_label", "特写图")
+        if style_label not in _STYLE_SET:
+            logger.warning(f"Invalid style_label '{style_label}' for {note_id}, defaulting to '特写图'")
+            style_label = "特写图"
+
+        # Extract reasoning
+        reasoning = result_json.get("reasoning", "")
+
+        return LabelingResult(
+            note_id=note_id,
+            label=label,
+            style_label=style_label,
+            reasoning=reasoning,
+            cost=cost
+        )
+
+    def _label_cache_key(
+        self,
+        post: Dict[str, Any],
+        mode: LabelingMode,
+        full_prompt: str,
+        include_likes: bool
+    ) -> str:
+        """
+        Signature of everything that goes into a label request: model, mode,
+        prompt and only the post fields the mode actually sends.
+        """
+        needs_cover, needs_all_images, needs_title, needs_content = self._MODE_FLAGS[mode]
+        signature = (
+            self.model_name,
+            mode.value,
+            full_prompt,
+            post.get("note_id", "unknown"),
+            post.get("title", "") if needs_title else None,
+            post.get("content", "") if needs_content else None,
+            post.get("likes", 0) if include_likes else None,
+            post.get("cover_image") if needs_cover or needs_all_images else None,
+            tuple(post.get("images", [])) if needs_all_images else None,
+        )
+        return hashlib.sha256(repr(signature).encode("utf-8")).hexdigest()
+
+    def _get_cached_label(self, cache_key: str) -> Optional[LabelingResult]:
+        """Return a cached result (cost 0 - no API spend) or None."""
+        oldest = time.time() - self.label_cache_ttl if self.label_cache_ttl else 0.0
+        with self._label_cache_lock:
+            entry = self._label_cache.get(cache_key)
+            if entry is not None and entry[0] < oldest:
+                del self._label_cache[cache_key]
+                entry = None
+            if entry is not None:
+                self._label_cache.move_to_end(cache_key)
+                cached = entry[1]
+            elif self._label_db is not None:
+                row = self._label_db.execute(
+                    "SELECT result, created_at FROM label_cache WHERE key = ? AND created_at >= ?",
+                    (cache_key, oldest)
+                ).fetchone()
+                if row is None:
+                    return None
+                cached = _json_loads(row[0])
+                self._remember_label(cache_key, cached, row[1])
+            else:
+                return None
+        return LabelingResult(**{**cached, "cost": 0.0})
+
+    def _remember_label(self, cache_key: str, result_dict: Dict[str, Any], created_at: float):
+        """Insert into the in-memory LRU (caller holds _label_cache_lock)."""
+        self._label_cache[cache_key] = (created_at, result_dict)
+        self._label_cache.move_to_end(cache_key)
+        while len(self._label_cache) > self.label_cache_size:
+            self._label_cache.popitem(last=False)
+
+    def _store_cached_label(self, cache_key: str, result: LabelingResult):
+        """Cache a successful result; errors are never cached so they get retried."""
+        if result.error or self.label_cache_size <= 0:
+            return
+        result_dict = result.to_dict()
+        now = time.time()
+        with self._label_cache_lock:
+            self._remember_label(cache_key, result_dict, now)
+            if self._label_db is not None:
+                self._label_db.execute(
+                    "INSERT OR REPLACE INTO label_cache (key, result, created_at) VALUES (?, ?, ?)",
+                    (cache_key, json.dumps(result_dict, ensure_ascii=False), now)
+                )
+                self._label_db.commit()
 
     def label_post(
         self,
         post: Dict[str, Any],
         user_description: str,
         mode: LabelingMode = LabelingMode.COVER_IMAGE,
-        include_likes: bool = False
+        include_likes: bool = False,
+        full_prompt: Optional[str] = None
     ) -> LabelingResult:
         """
         Label a single XHS post using Gemini 2.0 Flash via OpenRouter.
@@ -655,6 +1551,7 @@ Output your analysis in this exact JSON format:
             user_description: User's description of what posts they want to filter
             mode: Labeling mode (what to analyze)
             include_likes: Whether to include likes count in analysis
+            full_prompt: Prebuilt prompt for user_description (batch callers build it once)
 
         Returns:
             LabelingResult with label (满足/不满足), style_label, and reasoning
@@ -662,8 +1559,15 @@ Output your analysis in this exact JSON format:
         note_id = post.get("note_id", "unknown")
 
         try:
-            # Build the prompt
-            full_prompt = self._build_prompt(user_description)
+            # Build the prompt (unless the batch already built it)
+            if full_prompt is None:
+                full_prompt = self._build_prompt(user_description)
+
+            # Same post + prompt + mode already labeled: skip downloads and the API call
+            cache_key = self._label_cache_key(post, mode, full_prompt, include_likes)
+            cached = self._get_cached_label(cache_key)
+            if cached is not None:
+                return cached
 
             # Prepare content parts in OpenAI format
             content_parts = self._prepare_content_parts(post, mode, full_prompt, include_likes)
@@ -677,113 +1581,259 @@ Output your analysis in this exact JSON format:
                         "content": content_parts
                     }
                 ],
-                "temperature": 0.1,
-                "top_p": 0.95,
-                "max_tokens": 1024
+                **self.LABEL_GENERATION_PARAMS
             }
 
-            # Make the API request with retry logic for connection errors
-            max_retries = 3
-            response = None
-            for attempt in range(max_retries):
-                try:
-                    response = self.session.post(
-                        self.OPENROUTER_BASE_URL,
-                        json=payload,
-                        timeout=60
-                    )
-                    break  # Success, exit retry loop
-                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
-                    if attempt < max_retries - 1:
-                        wait_time = (attempt + 1) * 2  # 2s, 4s backoff
-                        logger.warning(f"Connection error for {note_id}, retry {attempt + 1}/{max_retries} in {wait_time}s: {e}")
-                        time.sleep(wait_time)
-                    else:
-                        raise  # Re-raise on final attempt
+            response_text, api_cost = self._post_chat_completion(payload, timeout=60, context=note_id)
+            logger.debug(f"API response for {note_id}: {response_text}")
 
-            if response is None:
-                raise ValueError("No response received after retries")
+            result_json = self._parse_json_response(response_text)
+            result = self._to_labeling_result(note_id, result_json, api_cost)
+            self._store_cached_label(cache_key, result)
+            return result
 
-            # Log error details for debugging
-            if response.status_code >= 400:
-                logger.error(f"API error {response.status_code}: {response.text}")
+        except RateLimitError:
+            raise
+        except Exception as e:
+            error_str = str(e)
+            logger.error(f"Error labeling post {note_id}: {error_str}")
 
-            # Check for rate limit errors
-            if response.status_code == 429:
-                retry_after = int(response.headers.get('Retry-After', 60))
-                raise RateLimitError(
-                    f"Rate limit exceeded. Please wait {retry_after}s before retrying.",
-                    retry_after=retry_after
-                )
+            # Check for rate limit errors in exception message
+            self._raise_if_rate_limited(error_str)
 
-            response.raise_for_status()
+            return LabelingResult(
+                note_id=note_id,
+                label="不满足",
+                style_label="特写图",
+                reasoning="",
+                error=error_str
+            )
+
+    def _build_group_content_parts(
+        self,
+        user_description: str,
+        posts: List[Dict[str, Any]],
+        mode: LabelingMode,
+        include_likes: bool = False
+    ) -> List[Dict[str, Any]]:
+        """
+        Build content parts that label several posts in one request.
+        Each post gets an enumerated text block, followed by its cover image
+        for cover-image modes.
 
-            # Parse the response
-            response_data = response.json()
+        Args:
+            user_description: User's description of what posts they want to filter
+            posts: Posts to enumerate in the prompt
+            mode: Groupable labeling mode (controls title/content/cover inclusion)
+            include_likes: Whether to include likes count in analysis
 
-            # Extract cost from OpenRouter response (in USD)
-            api_cost = 0.0
-            if 'usage' in response_data:
-                api_cost = response_data['usage'].get('cost', 0.0) or 0.0
+        Returns:
+            List of content parts in OpenAI format, asking for {"results": [...]}
+        """
+        needs_cover, _, needs_title, needs_content = self._MODE_FLAGS[mode]
+        header = f"""You are a content labeler for Xiaohongshu (小红书) posts. Analyze each of the {len(posts)} posts below independently and categorize it.
 
-            # Extract the message content
-            if 'choices' not in response_data or len(response_data['choices']) == 0:
-                raise ValueError("No response choices returned from API")
+User's filter criteria: {user_description}
 
-            response_text = response_data['choices'][0]['message']['content']
-            logger.debug(f"API response for {note_id}: {response_text}")
+Based on this criteria, determine if each post matches (满足) or doesn't match (不满足).
 
-            result_json = self._parse_json_response(response_text)
+Also classify each post's style into ONE of these 5 mutually exclusive categories (判断依据是视觉焦点):
+{STYLE_CATEGORY_GUIDE}
+
+Output your analysis in this exact JSON format, with exactly one entry per post (use the N from [POST N] as index and the note_id given for each post):
+{{
+  "results": [
+    {{
+      "index": <N>,
+      "note_id": "<note_id>",
+      "label": "<满足 or 不满足>",
+      "style_label": "<人物图 or 特写图 or 环境图 or 拼接图 or 信息图>",
+      "reasoning": "<brief explanation in Chinese>"
+    }}
+  ]
+}}"""
+        parts: List[Dict[str, Any]] = [{"type": "text", "text": header}]
+
+        # Fetch all cover images of the group concurrently (posts without one stay None)
+        cover_uris: List[Optional[str]] = [None] * len(posts)
+        if needs_cover:
+            with_cover = [i for i, post in enumerate(posts) if post.get("cover_image")]
+            fetched = self._download_images_as_base64([posts[i]["cover_image"] for i in with_cover])
+            for i, cover_uri in zip(with_cover, fetched):
+                cover_uris[i] = cover_uri
+
+        for i, (post, cover_uri) in enumerate(zip(posts, cover_uris), start=1):
+            block = f"[POST {i}] note_id: {post.get('note_id', 'unknown')}"
+            if needs_title:
+                title = post.get("title", "")
+                if title:
+                    block += f"\nTitle: {title}"
+            if needs_content:
+                content = post.get("content", "")
+                if content:
+                    block += f"\nContent: {content}"
+            if include_likes:
+                block += f"\nLikes: {post.get('likes', 0)}"
+            if needs_cover:
+                block += "\nCover image:" if cover_uri else "\nCover image: (unavailable)"
+            parts.append({"type": "text", "text": block})
+            if cover_uri:
+                parts.append({"type": "image_url", "image_url": {"url": cover_uri}})
+
+        return parts
+
+    def _label_post_group(
+        self,
+        posts: List[Dict[str, Any]],
+        user_description: str,
+        mode: LabelingMode,
+        include_likes: bool = False,
+        full_prompt: Optional[str] = None
+    ) -> List[LabelingResult]:
+        """
+        Label a group of posts with a single API request.
+        Posts already in the label cache are answered from it and left out of the
+        request. Response items are matched to posts by their [POST N] index, with
+        note_id as a cross-check (note_id alone only when it is present and unique
+        in the group); posts with no matching item (or the whole group on parse
+        failure) fall back to individual label_post calls.
 
-            # Extract label (满足/不满足)
-            label = result_json.get("label", "不满足")
-            if label not in ["满足", "不满足"]:
-                logger.warning(f"Invalid label '{label}' for {note_id}, defaulting to '不满足'")
-                label = "不满足"
+        Args:
+            posts: Posts to label together
+            user_description: User's description of what posts they want to filter
+            mode: Groupable labeling mode (see GROUPABLE_MODES)
+            include_likes: Whether to include likes count in analysis
+            full_prompt: Prebuilt single-post prompt (cache key and fallback)
 
-            # Extract style_label
-            style_label = result_json.get("style_label", "特写图")
-            if style_label not in STYLE_CATEGORIES:
-                logger.warning(f"Invalid style_label '{style_label}' for {note_id}, defaulting to '特写图'")
-                style_label = "特写图"
+        Returns:
+            List of LabelingResult in the same order as posts
 
-            # Extract reasoning
-            reasoning = result_json.get("reasoning", "")
+        Raises:
+            RateLimitError: On 429 / quota errors
+        """
+        if full_prompt is None:
+            full_prompt = self._build_prompt(user_description)
 
-            return LabelingResult(
-                note_id=note_id,
-                label=label,
-                style_label=style_label,
-                reasoning=reasoning,
-                cost=api_cost
-            )
+        # Same cache keys as label_post, so grouped and single runs share results
+        cache_keys = [self._label_cache_key(post, mode, full_prompt, include_likes) for post in posts]
+        cached = [self._get_cached_label(key) for key in cache_keys]
+        uncached = [post for post, hit in zip(posts, cached) if hit is None]
+        if len(uncached) <= 1:
+            # Nothing (or a single post) left to send - no group request needed
+            return [hit or self.label_post(post, user_description, mode, include_likes, full_prompt)
+                    for post, hit in zip(posts, cached)]
+
+        note_ids = [post.get("note_id", "unknown") for post in uncached]
+        context = f"group of {len(uncached)} ({note_ids[0]}...)"
+        by_position: Dict[int, LabelingResult] = {}
+
+        try:
+            content_parts = self._build_group_content_parts(user_description, uncached, mode, include_likes)
+            payload = {
+                "model": self.model_name,
+                "messages": [{"role": "user", "content": content_parts}],
+                **self.LABEL_GENERATION_PARAMS,
+                "max_tokens": self.LABEL_GENERATION_PARAMS["max_tokens"] * len(uncached),
+                "response_format": {
+                    "type": "json_schema",
+                    "json_schema": {"name": "post_labels", "strict": True, "schema": GROUP_LABEL_JSON_SCHEMA}
+                }
+            }
+
+            response_text, api_cost = self._post_chat_completion(payload, timeout=120, context=context)
+            logger.debug(f"Group API response for {context}: {response_text}")
+
+            result_json = self._parse_json_response(response_text, first_item=False)
+            items = result_json.get("results", []) if isinstance(result_json, dict) else result_json
+
+            # Split the single request cost evenly so batch totals stay accurate
+            per_post_cost = api_cost / len(uncached)
+            raw_ids = [post.get("note_id") for post in uncached]
+            # note_id alone only identifies a post when it is present and unique in the group
+            unique_positions = {
+                note_id: pos for pos, note_id in enumerate(raw_ids)
+                if note_id and raw_ids.count(note_id) == 1
+            }
+            for item in items:
+                if not isinstance(item, dict):
+                    continue
+                index = item.get("index")
+                if isinstance(index, int) and not isinstance(index, bool) and 1 <= index <= len(uncached):
+                    pos = index - 1
+                    if raw_ids[pos] and item.get("note_id") != raw_ids[pos]:
+                        logger.warning(f"Group result index {index} has note_id {item.get('note_id')}, expected {raw_ids[pos]} - ignored")
+                        continue
+                else:
+                    pos = unique_positions.get(item.get("note_id"))
+                    if pos is None:
+                        continue
+                if pos not in by_position:
+                    by_position[pos] = self._to_labeling_result(note_ids[pos], item, per_post_cost)
 
         except RateLimitError:
             raise
         except Exception as e:
             error_str = str(e)
-            logger.error(f"Error labeling post {note_id}: {error_str}")
+            logger.error(f"Error labeling {context}: {error_str}")
+            self._raise_if_rate_limited(error_str)
+
+        results = []
+        pos = 0  # Position of the next uncached post within the request
+        for post, cache_key, hit in zip(posts, cache_keys, cached):
+            if hit is not None:
+                results.append(hit)
+                continue
+            note_id = post.get("note_id", "unknown")
+            result = by_position.get(pos)
+            pos += 1
+            if result is None:
+                logger.warning(f"No group result for {note_id}, falling back to single-post labeling")
+                result = self.label_post(post, user_description, mode, include_likes, full_prompt)
+            else:
+                self._store_cached_label(cache_key, result)
+            results.append(result)
+        return results
 
-            # Check for rate limit errors in exception message
-            if "429" in error_str or "rate limit" in error_str.lower() or "quota" in error_str.lower():
-                import re
-                retry_after = 60
-                match = re.search(r'(\d+(?:\.\d+)?)\s*s', error_str)
-                if match:
-                    retry_after = int(float(match.group(1))) + 5
-
-                raise RateLimitError(
-                    f"Rate limit exceeded. Please wait {retry_after}s before retrying.",
-                    retry_after=retry_after
-                )
+    def label_posts_grouped(
+        self,
+        posts: List[Dict[str, Any]],
+        user_description: str,
+        mode: LabelingMode = LabelingMode.TITLE,
+        group_size: int = 10,
+        include_likes: bool = False
+    ) -> List[LabelingResult]:
+        """
+        Label posts in groups of group_size per API request.
+        Cuts round-trips and repeated prompt tokens ~group_size x versus label_post.
+        Cover-image modes are capped at MAX_GROUP_IMAGES posts per request.
 
-            return LabelingResult(
-                note_id=note_id,
-                label="不满足",
-                style_label="特写图",
-                reasoning="",
-                error=error_str
-            )
+        Args:
+            posts: List of XHS post dictionaries
+            user_description: User's description of what posts they want to filter
+            mode: Groupable labeling mode (text-only or cover-image modes)
+            group_size: Number of posts per API request
+            include_likes: Whether to include likes count in analysis
+
+        Returns:
+            List of LabelingResult in the same order as posts
+
+        Raises:
+            ValueError: If mode is not groupable (all-images modes)
+            RateLimitError: On 429 / quota errors
+        """
+        if mode not in self.GROUPABLE_MODES:
+            raise ValueError(f"label_posts_grouped does not support mode {mode.value}")
+
+        needs_cover = self._MODE_FLAGS[mode][0]
+        if needs_cover:
+            group_size = min(group_size, self.MAX_GROUP_IMAGES)
+
+        full_prompt = self._build_prompt(user_description)
+        results: List[LabelingResult] = []
+        for start in range(0, len(posts), group_size):
+            group = posts[start:start + group_size]
+            results.extend(self._label_post_group(group, user_description, mode, include_likes, full_prompt))
+        return results
 
     def analyze_vision_struct(
         self,
@@ -811,8 +1861,9 @@ Output your analysis in this exact JSON format:
                     error="No cover image available"
                 )
 
-            # Download and encode image
-            base64_url = self._download_image_as_base64(cover_url)
+            # Download and encode image at full resolution - VisionStruct extracts
+            # fine detail (text, small objects) that the labeling downscale would lose
+            base64_url = self._fetch_original_image_as_base64(cover_url)
             if not base64_url:
                 return VisionStructResult(
                     note_id=note_id,
@@ -820,9 +1871,11 @@ Output your analysis in this exact JSON format:
                     error="Failed to download cover image"
                 )
 
-            # Prepare content parts with VisionStruct prompt
+            # Prepare content parts with VisionStruct prompt. The ~4k-token prompt is
+            # identical for every post, so mark it as a cache breakpoint - OpenRouter
+            # forwards this to Gemini context caching and cached tokens bill at a discount
             content_parts = [
-                {"type": "text", "text": VISION_STRUCT_PROMPT},
+                {"type": "text", "text": VISION_STRUCT_PROMPT, "cache_control": {"type": "ephemeral"}},
                 {"type": "image_url", "image_url": {"url": base64_url}}
             ]
 
@@ -835,60 +1888,13 @@ Output your analysis in this exact JSON format:
                         "content": content_parts
                     }
                 ],
-                "temperature": 0.1,
-                "top_p": 0.95,
-                "max_tokens": 4096  # Larger for detailed VisionStruct output
+                **self.VISION_STRUCT_GENERATION_PARAMS
             }
 
-            # Make the API request with retry logic for connection errors
-            max_retries = 3
-            response = None
-            for attempt in range(max_retries):
-                try:
-                    response = self.session.post(
-                        self.OPENROUTER_BASE_URL,
-                        json=payload,
-                        timeout=120  # Longer timeout for detailed analysis
-                    )
-                    break  # Success, exit retry loop
-                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
-                    if attempt < max_retries - 1:
-                        wait_time = (attempt + 1) * 2
-                        logger.warning(f"VisionStruct connection error for {note_id}, retry {attempt + 1}/{max_retries} in {wait_time}s: {e}")
-                        time.sleep(wait_time)
-                    else:
-                        raise
-
-            if response is None:
-                raise ValueError("No response received after retries")
-
-            # Log error details for debugging
-            if response.status_code >= 400:
-                logger.error(f"VisionStruct API error {response.status_code}: {response.text}")
-
-            # Check for rate limit errors
-            if response.status_code == 429:
-                retry_after = int(response.headers.get('Retry-After', 60))
-                raise RateLimitError(
-                    f"Rate limit exceeded. Please wait {retry_after}s before retrying.",
-                    retry_after=retry_after
-                )
-
-            response.raise_for_status()
-
-            # Parse the response
-            response_data = response.json()
-
-            # Extract cost from OpenRouter response (in USD)
-            api_cost = 0.0
-            if 'usage' in response_data:
-                api_cost = response_data['usage'].get('cost', 0.0) or 0.0
-
-            # Extract the message content
-            if 'choices' not in response_data or len(response_data['choices']) == 0:
-                raise ValueError("No response choices returned from API")
-
-            response_text = response_data['choices'][0]['message']['content']
+            # Longer timeout for detailed analysis
+            response_text, api_cost = self._post_chat_completion(
+                payload, timeout=120, context=f"VisionStruct {note_id}"
+            )
             logger.debug(f"VisionStruct API response for {note_id}: {response_text[:200]}...")
 
             # Parse JSON response
@@ -908,17 +1914,7 @@ Output your analysis in this exact JSON format:
             logger.error(f"Error analyzing VisionStruct for {note_id}: {error_str}")
 
             # Check for rate limit errors in exception message
-            if "429" in error_str or "rate limit" in error_str.lower() or "quota" in error_str.lower():
-                import re
-                retry_after = 60
-                match = re.search(r'(\d+(?:\.\d+)?)\s*s', error_str)
-                if match:
-                    retry_after = int(float(match.group(1))) + 5
-
-                raise RateLimitError(
-                    f"Rate limit exceeded. Please wait {retry_after}s before retrying.",
-                    retry_after=retry_after
-                )
+            self._raise_if_rate_limited(error_str)
 
             return VisionStructResult(
                 note_id=note_id,
@@ -1040,6 +2036,36 @@ Output your analysis in this exact JSON format:
 
             return (list(self._current_posts), list(self._current_results))
 
+    def _load_checkpoint(self, path: str, checkpoint_key: str) -> Dict[str, LabelingResult]:
+        """
+        Read successful results for this batch signature from a checkpoint file.
+        Lines from other prompts/modes, a torn last line (crash mid-write) and
+        records that aren't valid results are ignored.
+
+        Returns:
+            Dict of note_id -> LabelingResult (cost 0 - nothing is spent on resume)
+        """
+        restored: Dict[str, LabelingResult] = {}
+        if not os.path.exists(path):
+            return restored
+
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    record = _json_loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if not isinstance(record, dict) or record.pop("checkpoint", None) != checkpoint_key:
+                    continue
+                record["cost"] = 0.0
+                try:
+                    result = LabelingResult(**record)
+                except (TypeError, KeyError):
+                    continue  # Missing/unexpected fields - label this post again
+                if result.note_id:
+                    restored[result.note_id] = result
+        return restored
+
     def label_posts_batch(
         self,
         posts: List[Dict[str, Any]],
@@ -1048,12 +2074,22 @@ Output your analysis in this exact JSON format:
         max_posts: Optional[int] = None,
         progress_callback: Optional[Callable[[int, int, str, str], None]] = None,
         include_likes: bool = False,
-        max_concurrency: int = 10
+        max_concurrency: int = 10,
+        result_callback: Optional[Callable[[int, LabelingResult], None]] = None,
+        results_path: Optional[str] = None,
+        rate_limit_retries: int = 3,
+        group_size: int = 1,
+        checkpoint_path: Optional[str] = None,
+        prefilter: Optional[Callable[[Dict[str, Any]], Optional[str]]] = None,
+        adaptive_concurrency: bool = False,
+        latency_target: Optional[float] = None
     ) -> BatchResult:
         """
         Label multiple XHS posts in batch with concurrent processing.
         Returns BatchResult wrapper that always contains results even on errors.
         Results are tracked in real-time for cancellation support via get_current_results().
+        Each result is also streamed to result_callback as soon as it completes, so
+        callers can persist incrementally instead of waiting for the whole batch.
 
         Args:
             posts: List of XHS post dictionaries
@@ -1063,6 +2099,24 @@ Output your analysis in this exact JSON format:
             progress_callback: Optional callback(index, total, title, status)
             include_likes: Whether to include likes count in analysis
             max_concurrency: Maximum parallel API calls (default: 10)
+            result_callback: Optional callback(index, result) fired per completed post
+                (calls are serialized, in completion order)
+            results_path: Optional JSONL file; each completed result is appended and
+                flushed immediately (read back with load_results_jsonl)
+            rate_limit_retries: Times a post is retried after a 429 (all workers pause
+                for retry_after first); afterwards the batch stops with partial results
+            group_size: Posts labeled per API request for GROUPABLE_MODES (1 = one
+                request per post); other modes always use one request per post
+            checkpoint_path: Optional JSONL checkpoint. Successful results are appended
+                as they complete; posts already in it (same model, mode and prompt)
+                are restored at cost 0 instead of being labeled again
+            prefilter: Optional cheap local rule, prefilter(post) -> "满足" / "不满足"
+                to decide a post without an API call, or None to send it to Gemini
+                (e.g. a keyword regex over title + content)
+            adaptive_concurrency: Start at max_concurrency and adjust in-flight calls
+                with AIMD (grow on success, halve on 429) up to ADAPTIVE_MAX_CONCURRENCY
+            latency_target: With adaptive_concurrency, also halve when the average
+                request latency (seconds) exceeds this
 
         Returns:
             BatchResult containing all results with partial completion info
@@ -1077,7 +2131,11 @@ Output your analysis in this exact JSON format:
         rate_limit_hit = False
         rate_limit_error = None
         interrupted_index = None
+        pause_until = 0.0  # Shared backoff deadline (time.monotonic) after a 429
         lock = threading.Lock()
+        aimd = AIMDConcurrency(
+            max_concurrency, maximum=self.ADAPTIVE_MAX_CONCURRENCY, latency_target=latency_target
+        ) if adaptive_concurrency else None
 
         # Initialize real-time tracking (thread-safe)
         with self._results_lock:
@@ -1086,48 +2144,171 @@ Output your analysis in this exact JSON format:
 
         logger.info(f"Starting concurrent batch labeling: {total} posts, concurrency={max_concurrency}")
 
-        def process_single(idx: int, post: Dict[str, Any]) -> tuple[int, LabelingResult]:
-            """Process a single post and return (index, result)"""
-            nonlocal rate_limit_hit, rate_limit_error, interrupted_index
-
-            # Skip if rate limit already hit - mark as skipped (not processed)
-            if rate_limit_hit:
-                return idx, LabelingResult(
-                    note_id=post.get('note_id', 'unknown'),
-                    label="",  # Empty = not processed
-                    style_label="",
-                    reasoning="",
-                    error="Skipped due to rate limit"
-                )
-
-            title = post.get('title', 'Untitled')[:50]
-            note_id = post.get('note_id', 'unknown')
+        # Prompt is identical for every post in the batch - build it once
+        full_prompt = self._build_prompt(user_description)
+
+        # Restore posts already labeled by a previous run of the same batch
+        pending = list(range(total))
+        restored_indices: List[int] = []
+        checkpoint_key = None
+        if checkpoint_path:
+            checkpoint_key = hashlib.sha256(
+                repr((self.model_name, mode.value, full_prompt, include_likes)).encode("utf-8")
+            ).hexdigest()[:16]
+            restored = self._load_checkpoint(checkpoint_path, checkpoint_key)
+            # Restore is keyed by note_id, so posts without one (or sharing one) are
+            # always labeled again rather than all receiving the same record
+            note_id_counts = Counter(post.get('note_id') for post in posts)
+            pending = []
+            for idx, post in enumerate(posts):
+                note_id = post.get('note_id')
+                prior = restored.get(note_id) if note_id and note_id_counts[note_id] == 1 else None
+                if prior is None:
+                    pending.append(idx)
+                else:
+                    results[idx] = prior
+                    restored_indices.append(idx)
+            if restored_indices:
+                logger.info(f"Resumed {len(restored_indices)}/{total} posts from checkpoint {checkpoint_path}")
+
+        # Posts a local rule can already decide never reach the API
+        prefiltered_indices: List[int] = []
+        if prefilter:
+            undecided = []
+            for idx in pending:
+                # User code: a failure or invalid answer just sends the post to Gemini
+                try:
+                    label = prefilter(posts[idx])
+                except Exception as e:
+                    logger.warning(f"Prefilter failed for {posts[idx].get('note_id', 'unknown')}: {e}")
+                    label = None
+                if label is not None and label not in _LABEL_SET:
+                    logger.warning(f"Prefilter returned invalid label {label!r} for {posts[idx].get('note_id', 'unknown')}, ignoring")
+                    label = None
+                if label is None:
+                    undecided.append(idx)
+                else:
+                    # Style needs the model; use the same default as unparseable responses
+                    results[idx] = LabelingResult(
+                        note_id=posts[idx].get('note_id', 'unknown'),
+                        label=label,
+                        style_label="特写图",
+                        reasoning="本地规则预筛选"
+                    )
+                    prefiltered_indices.append(idx)
+            if prefiltered_indices:
+                logger.info(f"Prefilter decided {len(prefiltered_indices)}/{len(pending)} posts locally")
+            pending = undecided
+
+        # Work units: single posts, or groups sharing one request for groupable modes
+        if group_size > 1 and mode in self.GROUPABLE_MODES:
+            if self._MODE_FLAGS[mode][0]:
+                group_size = min(group_size, self.MAX_GROUP_IMAGES)
+            units = [pending[start:start + group_size] for start in range(0, len(pending), group_size)]
+        else:
+            units = [[idx] for idx in pending]
+
+        # Warm the image cache a bounded window of units ahead of the workers, so
+        # they mostly spend their time on the API call. The prefetch has its own
+        # small executor: per-post downloads on _download_pool never queue behind it.
+        needs_cover, needs_all_images, _, _ = self._MODE_FLAGS[mode]
+        prefetch_enabled = (needs_cover or needs_all_images) and (
+            self.image_cache_dir is not None or self.image_cache_size > 0
+        )
+        prefetcher: Optional[ThreadPoolExecutor] = None
+        next_prefetch = 0  # Position in units of the next unit to prefetch
+
+        def prefetch_unit(indices: List[int]):
+            """Download (into the cache) the images of one unit's uncached posts"""
+            for idx in indices:
+                post = posts[idx]
+                if self._get_cached_label(self._label_cache_key(post, mode, full_prompt, include_likes)) is not None:
+                    continue  # Answered from the label cache without images
+                for url in self._post_image_urls(post, mode):
+                    self._download_image_as_base64(url)
+
+        def prefetch_ahead(count: int = 1):
+            """Queue prefetch for the next count units (no-op when prefetch is off)"""
+            nonlocal next_prefetch
+            if prefetcher is None:
+                return
+            with lock:
+                start = next_prefetch
+                next_prefetch = min(len(units), start + count)
+            for indices in units[start:next_prefetch]:
+                prefetcher.submit(prefetch_unit, indices)
 
-            try:
-                result = self.label_post(post, user_description, mode, include_likes)
-                return idx, result
-            except RateLimitError as e:
-                with lock:
-                    if not rate_limit_hit:
-                        rate_limit_hit = True
-                        rate_limit_error = e
-                        interrupted_index = idx
-                return idx, LabelingResult(
-                    note_id=note_id,
-                    label="",  # Empty = not processed
-                    style_label="",
-                    reasoning="",
-                    error=f"Rate limit: {e}"
-                )
+        def unprocessed(idx: int, error: str) -> LabelingResult:
+            """Placeholder result for a post that was not labeled"""
+            return LabelingResult(
+                note_id=posts[idx].get('note_id', 'unknown'),
+                label="",  # Empty = not processed
+                style_label="",
+                reasoning="",
+                error=error
+            )
 
-        def update_progress(idx: int, result: LabelingResult):
+        def process_unit(indices: List[int]) -> List[Tuple[int, LabelingResult]]:
+            """Label one post (or one group of posts in a single request) and return (index, result) pairs"""
+            nonlocal rate_limit_hit, rate_limit_error, interrupted_index, pause_until
+
+            note_id = posts[indices[0]].get('note_id', 'unknown')
+            prefetch_ahead()  # Keep the prefetch window a fixed distance ahead
+            attempt = 0
+            while True:
+                # Wait out a shared backoff started by any worker's 429; jitter so
+                # the paused workers don't all hit the API in the same instant
+                wait = pause_until - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait + random.uniform(0, self.RATE_LIMIT_JITTER))
+
+                # Skip if rate limit already hit - mark as skipped (not processed)
+                if rate_limit_hit:
+                    return [(idx, unprocessed(idx, "Skipped due to rate limit")) for idx in indices]
+
+                if aimd:
+                    aimd.acquire()
+                # Only the API round trips feed AIMD - image downloads and label
+                # cache hits say nothing about the provider's capacity
+                stats = {"api_seconds": 0.0, "api_calls": 0, "server_errors": 0}
+                self._call_stats.current = stats
+                overloaded = False
+                try:
+                    if len(indices) == 1:
+                        unit_results = [self.label_post(posts[indices[0]], user_description, mode, include_likes, full_prompt)]
+                    else:
+                        unit_results = self._label_post_group([posts[idx] for idx in indices], user_description, mode, include_likes, full_prompt)
+                    return list(zip(indices, unit_results))
+                except RateLimitError as e:
+                    overloaded = True
+                    with lock:
+                        retryable = attempt < rate_limit_retries and e.retry_after <= self.RATE_LIMIT_MAX_WAIT
+                        if retryable and not rate_limit_hit:
+                            pause_until = max(pause_until, time.monotonic() + e.retry_after)
+                            attempt += 1
+                            logger.warning(f"Rate limited on {note_id}, pausing workers {e.retry_after}s (retry {attempt}/{rate_limit_retries})")
+                            continue
+                        if not rate_limit_hit:
+                            rate_limit_hit = True
+                            rate_limit_error = e
+                            interrupted_index = indices[0]
+                    return [(idx, unprocessed(idx, f"Rate limit: {e}")) for idx in indices]
+                finally:
+                    self._call_stats.current = None
+                    if aimd:
+                        latency = stats["api_seconds"] / stats["api_calls"] if stats["api_calls"] else None
+                        overloaded = overloaded or stats["server_errors"] >= self.AIMD_SERVER_ERROR_THRESHOLD
+                        aimd.release(latency, overloaded)
+
+        def update_progress(idx: int, result: LabelingResult, skip_checkpoint: bool = False):
             """Thread-safe progress update and real-time result tracking"""
             nonlocal completed_count
             with lock:
                 completed_count += 1
-                # Update real-time tracking
-                with self._results_lock:
-                    self._current_results[idx] = result
+                # Update real-time tracking; each index is written once, and a single
+                # item assignment is atomic, so readers snapshotting under
+                # _results_lock never see a torn list
+                tracked_results[idx] = result
                 title = posts[idx].get('title', 'Untitled')[:50]
                 if progress_callback:
                     if result.error:
@@ -1135,33 +2316,62 @@ Output your analysis in this exact JSON format:
                     else:
                         status = f"done: {result.label} ({result.style_label})"
                     progress_callback(completed_count, total, title, status)
+                if results_file:
+                    results_file.write(_json_dumps_line({"index": idx, **result.to_dict()}))
+                    results_file.flush()  # Partial results survive a crash
+                if checkpoint_file and result.label and not result.error and not skip_checkpoint:
+                    checkpoint_file.write(_json_dumps_line({"checkpoint": checkpoint_key, **result.to_dict()}))
+                    checkpoint_file.flush()
+                if result_callback:
+                    result_callback(idx, result)
+
+        # The tracking list is only swapped (under _results_lock) at batch start/end
+        with self._results_lock:
+            tracked_results = self._current_results
 
         # Execute with ThreadPoolExecutor for concurrent processing
-        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
-            # Submit all tasks
-            futures = {
-                executor.submit(process_single, idx, post): idx
-                for idx, post in enumerate(posts)
-            }
-
-            # Process results as they complete
-            for future in as_completed(futures):
-                try:
-                    idx, result = future.result()
-                    results[idx] = result
-                    update_progress(idx, result)
-                except Exception as e:
-                    idx = futures[future]
-                    note_id = posts[idx].get('note_id', 'unknown')
-                    error_result = LabelingResult(
-                        note_id=note_id,
-                        label="",  # Empty = not processed
-                        style_label="",
-                        reasoning="",
-                        error=str(e)
-                    )
-                    results[idx] = error_result
-                    update_progress(idx, error_result)
+        results_file = open(results_path, "wb") if results_path else None
+        checkpoint_file = open(checkpoint_path, "ab") if checkpoint_path else None
+        try:
+            # Restored and prefiltered results go through the same emit path as
+            # labeled ones, so results file and callbacks cover every post. Neither
+            # is (re)written to the checkpoint: restored rows are already there, and
+            # checkpoint_key doesn't cover the prefilter, so a later run with another
+            # rule (or none) must not restore its verdicts as model labels
+            for idx in restored_indices:
+                update_progress(idx, results[idx], skip_checkpoint=True)
+            for idx in prefiltered_indices:
+                update_progress(idx, results[idx], skip_checkpoint=True)
+
+            if prefetch_enabled:
+                prefetcher = ThreadPoolExecutor(max_workers=self.PREFETCH_WORKERS, thread_name_prefix="xhs-prefetch")
+                prefetch_ahead(2 * max_concurrency)
+
+            pool_size = self.ADAPTIVE_MAX_CONCURRENCY if aimd else max_concurrency
+            with ThreadPoolExecutor(max_workers=pool_size) as executor:
+                # Submit all tasks - one per post, or one per group of posts
+                futures = {
+                    executor.submit(process_unit, indices): indices
+                    for indices in units
+                }
+
+                # Process results as they complete
+                for future in as_completed(futures):
+                    try:
+                        unit_results = future.result()
+                    except Exception as e:
+                        unit_results = [(idx, unprocessed(idx, str(e))) for idx in futures[future]]
+                    for idx, result in unit_results:
+                        results[idx] = result
+                        update_progress(idx, result)
+        finally:
+            # Drop queued prefetches for posts that were never labeled (e.g. rate limit stop)
+            if prefetcher is not None:
+                prefetcher.shutdown(wait=False, cancel_futures=True)
+            if results_file:
+                results_file.close()
+            if checkpoint_file:
+                checkpoint_file.close()
 
         # Count results: successful = has label, error = has error, skipped = neither
         final_results = [r for r in results if r is not None]
@@ -1171,6 +2381,8 @@ Output your analysis in this exact JSON format:
         total_cost = sum(r.cost for r in final_results if r is not None)
 
         logger.info(f"Batch complete: {success_count}/{total} successful, {error_count} errors, partial={rate_limit_hit}, cost=${total_cost:.4f}")
+        if aimd:
+            logger.info(f"Adaptive concurrency settled at {aimd.limit:.1f}")
 
         # Clear real-time tracking on completion
         with self._results_lock:
@@ -1195,6 +2407,25 @@ Output your analysis in this exact JSON format:
         )
 
 
+def load_results_jsonl(path: str) -> List[LabelingResult]:
+    """
+    Load results written by label_posts_batch(results_path=...).
+
+    Args:
+        path: JSONL file path
+
+    Returns:
+        LabelingResult list in original post order (posts never completed are absent)
+    """
+    records = []
+    with open(path, "rb") as f:
+        for line in f:
+            if line.strip():
+                records.append(_json_loads(line))
+    records.sort(key=lambda r: r.pop("index"))
+    return [LabelingResult(**r) for r in records]
+
+
 # Test function
 def test_openrouter_labeler():
     """Quick test of the OpenRouter Gemini labeler with one image"""
@@ -1216,7 +2447,7 @@ def test_openrouter_labeler():
     logger.info(f"Using sample file: {sample_file}")
 
     with open(sample_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+        data = _json_loads(f.read())
 
     posts = data.get("posts", [])
     if not posts: